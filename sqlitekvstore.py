@@ -2,20 +2,138 @@
 
 
 import contextlib
-import os.path
+import itertools
+import pathlib
+import queue
 import sqlite3
-from typing import Callable, Dict, Generator, Iterable, Optional, Tuple, TypeVar, Union
+import sys
+import threading
+import zlib
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 # keep mypy happy, keys/values can be any type supported by SQLite
 T = TypeVar("T")
 
 __version__ = "0.3.0"
 
-__all__ = ["SQLiteKVStore"]
+__all__ = ["SQLiteKVStore", "ShardedKVStore"]
+
+# tuning applied to every file-backed connection; cache_size is negative so
+# it's in KiB (64 MiB) rather than pages and mmap_size caps the mapped region
+_PRAGMAS = """
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-64000;
+    PRAGMA mmap_size=268435456;
+"""
+
+# max number of idle read-only connections kept for reuse in WAL mode
+_READ_POOL_SIZE = 8
+
+# the primary key is already backed by a unique index, no need for another;
+# {without_rowid} is filled in with "WITHOUT ROWID" or ""
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS _about (
+        id INTEGER PRIMARY KEY,
+        description TEXT);
+    CREATE TABLE IF NOT EXISTS data (
+        key BLOB PRIMARY KEY NOT NULL,
+        value BLOB) {without_rowid};
+"""
+
+# number of rows fetched at a time when iterating over the database
+_FETCH_SIZE = 1000
+
+# max number of keys bound in a single "WHERE key IN (...)" statement;
+# older SQLite versions limit a statement to 999 host parameters
+_MAX_VARIABLES = 500
+
+_SQL_GET = "SELECT value FROM data WHERE key = ?;"
+# upsert updates an existing row in place whereas INSERT OR REPLACE deletes
+# the row and inserts a new one; upsert requires SQLite 3.24+
+_SQL_SET = (
+    "INSERT INTO data (key, value) VALUES (?, ?) "
+    "ON CONFLICT(key) DO UPDATE SET value = excluded.value;"
+    if sqlite3.sqlite_version_info >= (3, 24, 0)
+    else "INSERT OR REPLACE INTO data VALUES (?, ?);"
+)
+# used by set() when tracking length: the insert's rowcount shows whether key was new
+_SQL_INSERT_NEW = (
+    "INSERT INTO data (key, value) VALUES (?, ?) ON CONFLICT(key) DO NOTHING;"
+    if sqlite3.sqlite_version_info >= (3, 24, 0)
+    else "INSERT OR IGNORE INTO data VALUES (?, ?);"
+)
+_SQL_UPDATE = "UPDATE data SET value = ? WHERE key = ?;"
+_SQL_GET_ROWID = "SELECT rowid FROM data WHERE key = ?;"
+_SQL_DEL = "DELETE FROM data WHERE key = ?;"
+_SQL_CONTAINS = "SELECT EXISTS(SELECT 1 FROM data WHERE key = ?);"
+_SQL_LEN = "SELECT COUNT(*) FROM data;"
+_SQL_DATA_VERSION = "PRAGMA data_version;"
+_SQL_KEYS = "SELECT key FROM data;"
+_SQL_VALUES = "SELECT value FROM data;"
+_SQL_ITEMS = "SELECT key, value FROM data;"
+# DELETE without a WHERE clause lets SQLite use its truncate optimization
+# which drops the whole table's pages at once instead of deleting row by row
+_SQL_WIPE = "DELETE FROM data;"
+_SQL_VACUUM = "VACUUM;"
+_SQL_GET_ABOUT = "SELECT description FROM _about;"
+_SQL_SET_ABOUT = "INSERT OR REPLACE INTO _about VALUES (?, ?);"
+
+
+def _identity(value: T) -> T:
+    """Return value unchanged; used when no serialize/deserialize function is provided"""
+    return value
+
+
+def _chunked(iterable: Iterable[T], size: int) -> Generator[List[T], None, None]:
+    """Yield lists of up to size items from iterable"""
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _placeholders(count: int) -> str:
+    """Return comma separated list of count '?' placeholders"""
+    return ",".join("?" * count)
+
+
+def _stable_hash(key: Any) -> int:
+    """Return hash of key that is the same in every process, unlike hash() for str/bytes"""
+    if isinstance(key, str):
+        data = key.encode()
+    elif isinstance(key, (bytes, bytearray, memoryview)):
+        # sqlite binds all of these as the same BLOB
+        data = bytes(key)
+    else:
+        # SQLite compares numeric keys by value so 1, 1.0 and True are the same key
+        if isinstance(key, bool) or (isinstance(key, float) and key.is_integer()):
+            key = int(key)
+        data = str(key).encode()
+    return zlib.crc32(data)
 
 
 class SQLiteKVStore:
-    """Simple Key-Value Store that uses sqlite3 database as backend"""
+    """Simple Key-Value Store that uses sqlite3 database as backend
+
+    A single SQLiteKVStore may be shared between threads; writes are serialized
+    with a lock so only one thread at a time writes to the database. In WAL mode,
+    reads use a pool of read-only connections so they can run in parallel.
+
+    The connection is in autocommit mode; single statement writes commit
+    immediately and multi-statement writes are wrapped in an explicit transaction.
+    """
 
     def __init__(
         self,
@@ -23,6 +141,7 @@ class SQLiteKVStore:
         serialize: Optional[Callable[[T], T]] = None,
         deserialize: Optional[Callable[[T], T]] = None,
         wal: bool = False,
+        without_rowid: bool = True,
     ):
         """Opens the database if it exists, otherwise creates it
 
@@ -32,6 +151,9 @@ class SQLiteKVStore:
             deserialize: optional function to deserialize values on get
             wal: enable write-ahead logging which may offer significant speed boost;
                 once enabled, WAL mode will not be disabled, even if wal=False
+            without_rowid: create the data table as a WITHOUT ROWID table which stores
+                values inline with the key; set to False if you'll be storing large values;
+                only used when creating a new database
         """
 
         if serialize and not callable(serialize):
@@ -40,65 +162,193 @@ class SQLiteKVStore:
             raise TypeError("deserialize must be callable")
 
         self._dbpath = dbpath
-        self._serialize_func = serialize
-        self._deserialize_func = deserialize
-        self._conn = (
-            sqlite3.connect(dbpath)
-            if os.path.exists(dbpath)
-            else self._create_database(dbpath)
+        # bind directly (rather than checking for None on every call)
+        self._serialize: Callable[[Any], Any] = serialize or _identity
+        self._deserialize: Callable[[Any], Any] = deserialize or _identity
+        self._lock = threading.RLock()
+        self._about: Optional[str] = None
+        # cached row count maintained by writes so len() doesn't need a full scan;
+        # None means unknown, see __len__ for how it's validated
+        self._len: Optional[int] = None
+        self._len_changes = 0
+        self._len_data_version = 0
+        # connect creates the file if needed and the schema is idempotent so no need
+        # to check if the database exists first; isolation_level=None disables the
+        # sqlite3 module's implicit transactions, see _transaction()
+        self._conn = sqlite3.connect(
+            dbpath, check_same_thread=False, isolation_level=None
+        )
+        self._conn.executescript(
+            _SCHEMA.format(without_rowid="WITHOUT ROWID" if without_rowid else "")
         )
 
+        if str(dbpath) != ":memory:":
+            self._conn.executescript(_PRAGMAS)
+
         if wal:
             self._conn.execute("PRAGMA journal_mode=WAL;")
             self._conn.execute("PRAGMA synchronous=NORMAL;")
-            self._conn.commit()
-
-    def _create_database(self, dbpath: str):
-        """Create the key-value database"""
-        conn = sqlite3.connect(dbpath)
-        cursor = conn.cursor()
-        cursor.execute(
-            """CREATE TABLE IF NOT EXISTS _about (
-                id INTEGER PRIMARY KEY,
-                description TEXT);
-            """
-        )
-        cursor.execute(
-            """CREATE TABLE IF NOT EXISTS
-            data (key BLOB PRIMARY KEY NOT NULL, value BLOB);"""
-        )
-        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_key ON data (key);")
-        conn.commit()
-        return conn
+
+        # WAL allows readers on other connections to run alongside the writer;
+        # check the actual mode as it persists even if wal=False
+        self._read_pool: Optional[queue.LifoQueue] = None
+        self._reader_uri = ""
+        if (
+            str(dbpath) != ":memory:"
+            and self._conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+        ):
+            self._read_pool = queue.LifoQueue(maxsize=_READ_POOL_SIZE)
+            # resolve the path now as readers are opened lazily and a relative
+            # path would otherwise depend on the working directory at that time
+            self._reader_uri = f"{pathlib.Path(dbpath).absolute().as_uri()}?mode=ro"
+
+        # _get is the hot path; when reads go straight to the main connection,
+        # shadow it with a closure with everything it needs bound up front;
+        # the closure must not reference self or it would create a reference cycle
+        if self._read_pool is None:
+            self._get = self._make_get(deserialize)  # type: ignore[method-assign,assignment]
+
+    def _make_get(
+        self, deserialize: Optional[Callable[[Any], Any]]
+    ) -> Callable[[Any], Any]:
+        """Return function to get value for key from the main connection
+        or raise KeyError if key not found"""
+        execute = self._conn.execute
+        lock = self._lock
+
+        if deserialize is None:
+
+            def _get(key: Any) -> Any:
+                with lock:
+                    result = execute(_SQL_GET, (key,)).fetchone()
+                if result:
+                    return result[0]
+                raise KeyError(key)
+
+        else:
+
+            def _get(key: Any) -> Any:
+                with lock:
+                    result = execute(_SQL_GET, (key,)).fetchone()
+                if result:
+                    return deserialize(result[0])
+                raise KeyError(key)
+
+        return _get
 
     def connection(self) -> sqlite3.Connection:
-        """Return connection to underlying sqlite3 database"""
+        """Return connection to underlying sqlite3 database
+
+        Note: the connection is in autocommit mode (isolation_level=None)
+        """
         return self._conn
 
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Hold the write lock and run the enclosed statements in a single transaction"""
+        conn = self._conn
+        with self._lock:
+            # IMMEDIATE takes the database write lock up front so the statements
+            # can't fail with SQLITE_BUSY part way through; COMMIT still can
+            # (e.g. waiting on readers without WAL) so it's inside the try too
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                yield conn
+                conn.execute("COMMIT;")
+            except BaseException:
+                # some errors cause SQLite to roll back on its own
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK;")
+                raise
+
+    def _connect_reader(self) -> sqlite3.Connection:
+        """Open a new read-only connection to the database"""
+        conn = sqlite3.connect(self._reader_uri, uri=True, check_same_thread=False)
+        conn.executescript(_PRAGMAS)
+        return conn
+
+    def _fetch(self, sql: str) -> Generator[List[Any], None, None]:
+        """Execute sql and yield the resulting rows in batches"""
+        if self._read_pool is not None:
+            with self._reader() as conn:
+                cursor = conn.execute(sql)
+                while rows := cursor.fetchmany(_FETCH_SIZE):
+                    yield rows
+            return
+
+        # on the main connection only hold the lock while fetching each batch,
+        # not while suspended, so other threads can write between batches
+        with self._lock:
+            cursor = self._conn.execute(sql)
+            rows = cursor.fetchmany(_FETCH_SIZE)
+        while rows:
+            yield rows
+            with self._lock:
+                rows = cursor.fetchmany(_FETCH_SIZE)
+
+    @contextlib.contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        """Check out a connection for reading: a pooled read-only connection
+        in WAL mode, otherwise the main connection while holding the lock so
+        another thread's uncommitted transaction isn't visible"""
+        if self._read_pool is None:
+            with self._lock:
+                yield self._conn
+            return
+
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect_reader()
+        try:
+            yield conn
+        finally:
+            # pool may have been closed while conn was checked out
+            pool = self._read_pool
+            try:
+                if pool is None:
+                    raise queue.Full
+                pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
     def set(self, key: T, value: T):
         """Set key:value pair"""
         serialized_value = self._serialize(value)
-        conn = self.connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR REPLACE INTO data VALUES (?, ?);", (key, serialized_value)
-        )
-        conn.commit()
+        with self._lock:
+            conn = self._conn
+            if self._len is None:
+                conn.execute(_SQL_SET, (key, serialized_value))
+                return
+
+            # keeping track of length so use the writes' own row counts to tell
+            # whether key is new: a new key is a single insert, an existing key
+            # is a no-op insert followed by an update
+            if conn.execute(_SQL_INSERT_NEW, (key, serialized_value)).rowcount:
+                self._adjust_len(1, 1)
+            elif conn.execute(_SQL_UPDATE, (serialized_value, key)).rowcount:
+                self._adjust_len(0, 1)
+            else:  # pragma: no cover
+                # key was deleted by another connection between the two statements
+                conn.execute(_SQL_SET, (key, serialized_value))
+                self._len = None
 
     def set_many(self, items: Union[Iterable[Tuple[T, T]], Dict[T, T]]):
         """Set multiple key:value pairs
 
         Args:
             items: iterable of (key, value) tuples or dictionary of key:value pairs
+
+        Note: all pairs are written in a single transaction
         """
-        conn = self.connection()
-        cursor = conn.cursor()
         _items = items.items() if isinstance(items, dict) else items
-        cursor.executemany(
-            "INSERT OR REPLACE INTO data VALUES (?, ?);",
-            ((key, self._serialize(value)) for key, value in _items),
-        )
-        conn.commit()
+        # serialize before opening the transaction so a failing serializer
+        # doesn't leave the write lock held
+        rows = [(key, self._serialize(value)) for key, value in _items]
+        with self._transaction() as conn:
+            conn.executemany(_SQL_SET, rows)
+            # can't tell how many keys were new without checking each one
+            self._len = None
 
     def get(self, key: T, default: Optional[T] = None) -> Optional[T]:
         """Get value for key
@@ -116,12 +366,88 @@ class SQLiteKVStore:
         except KeyError:
             return default
 
+    def get_many(self, keys: Iterable[T]) -> Dict[T, T]:
+        """Get values for multiple keys
+
+        Args:
+            keys: iterable of keys to get from key-value store
+
+        Returns: dictionary of key:value pairs for keys found in the key-value store;
+            keys that are not found are omitted
+        """
+        results = {}
+        with self._reader() as conn:
+            for chunk in _chunked(keys, _MAX_VARIABLES):
+                cursor = conn.execute(
+                    f"SELECT key, value FROM data WHERE key IN ({_placeholders(len(chunk))});",
+                    chunk,
+                )
+                for key, value in cursor:
+                    results[key] = self._deserialize(value)
+        return results
+
+    def get_blob(self, key: T):
+        """Open the stored value for key for incremental reading without loading it into memory
+
+        Args:
+            key: key to get from key-value store
+
+        Returns: read-only sqlite3.Blob for the stored value; close it when done
+            (or use it as a context manager)
+
+        Raises:
+            KeyError if key not found
+            NotImplementedError if not running on Python 3.11+
+            sqlite3.NotSupportedError if the database was not created with without_rowid=False
+
+        Note: the blob contains the stored value, that is, the value as returned by
+            the serialize function if one was provided. The blob is opened on the
+            store's main connection: setting the same key again while the blob is
+            open invalidates it, and without WAL mode an open blob holds a read lock
+            on the database until it is closed.
+        """
+        if sys.version_info < (3, 11):
+            raise NotImplementedError("get_blob requires Python 3.11 or later")
+        conn = self.connection()
+        try:
+            result = conn.execute(_SQL_GET_ROWID, (key,)).fetchone()
+        except sqlite3.OperationalError as e:
+            # WITHOUT ROWID tables have no rowid column which blobopen needs;
+            # anything else (e.g. database is locked) is passed through as is
+            if "no such column: rowid" not in str(e):
+                raise
+            raise sqlite3.NotSupportedError(
+                "get_blob requires a database created with without_rowid=False"
+            ) from e
+        if not result:
+            raise KeyError(key)
+        return conn.blobopen("data", "value", result[0], readonly=True)
+
     def delete(self, key: T):
         """Delete key from key-value store"""
-        conn = self.connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM data WHERE key = ?;", (key,))
-        conn.commit()
+        self._delete(key)
+
+    def delete_many(self, keys: Iterable[T]):
+        """Delete multiple keys from key-value store
+
+        Args:
+            keys: iterable of keys to delete
+
+        Note: all keys are deleted in a single transaction
+        """
+        # collect keys before opening the transaction so the caller's iterable
+        # doesn't run while holding the write lock
+        chunks = list(_chunked(keys, _MAX_VARIABLES))
+        deleted = 0
+        with self._transaction() as conn:
+            for chunk in chunks:
+                deleted += conn.execute(
+                    f"DELETE FROM data WHERE key IN ({_placeholders(len(chunk))});",
+                    chunk,
+                ).rowcount
+        # only adjust once the transaction has committed
+        with self._lock:
+            self._adjust_len(-deleted, deleted)
 
     def pop(self, key) -> Optional[T]:
         """Delete key and return value"""
@@ -135,48 +461,42 @@ class SQLiteKVStore:
 
     def values(self) -> Generator[T, None, None]:
         """Return values as generator"""
-        conn = self.connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM data;")
-        for value in cursor:
-            yield self._deserialize(value[0])
+        deserialize = self._deserialize
+        for rows in self._fetch(_SQL_VALUES):
+            yield from (deserialize(row[0]) for row in rows)
 
     def items(self) -> Generator[Tuple[T, T], None, None]:
         """Return items (key, value) as generator"""
-        conn = self.connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT key, value FROM data;")
-        for key, value in cursor:
-            yield key, self._deserialize(value)
+        deserialize = self._deserialize
+        for rows in self._fetch(_SQL_ITEMS):
+            yield from ((key, deserialize(value)) for key, value in rows)
 
     def close(self):
         """Close the database"""
-        self.connection().close()
+        with self._lock:
+            pool, self._read_pool = self._read_pool, None
+            while pool is not None and not pool.empty():
+                pool.get_nowait().close()
+            self.connection().close()
 
     @property
     def about(self) -> str:
         """Return description for the database"""
-        results = (
-            self.connection()
-            .cursor()
-            .execute("SELECT description FROM _about;")
-            .fetchone()
-        )
-        return results[0] if results else ""
+        # cache the description as it only changes via the setter; read and
+        # cache under the lock so a concurrent setter can't be overwritten
+        # with the old description
+        with self._lock:
+            if self._about is None:
+                results = self.connection().execute(_SQL_GET_ABOUT).fetchone()
+                self._about = results[0] if results else ""
+            return self._about
 
     @about.setter
     def about(self, description: str):
         """Set description of the database"""
-        conn = self.connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR REPLACE INTO _about VALUES (?, ?);",
-            (
-                1,
-                description,
-            ),
-        )
-        conn.commit()
+        with self._lock:
+            self._conn.execute(_SQL_SET_ABOUT, (1, description))
+            self._about = description
 
     @property
     def path(self) -> str:
@@ -185,29 +505,42 @@ class SQLiteKVStore:
 
     def wipe(self):
         """Wipe the database"""
-        self.connection().execute("DELETE FROM data;")
-        self.connection().commit()
-        self.vacuum()
+        with self._lock:
+            self._conn.execute(_SQL_WIPE)
+            self._len = 0
+            self._len_changes = self._conn.total_changes
+            self.vacuum()
 
     def vacuum(self):
         """Vacuum the database, ref: https://www.sqlite.org/matrix/lang_vacuum.html"""
-        self.connection().execute("VACUUM;")
+        with self._lock:
+            self.connection().execute(_SQL_VACUUM)
 
     def _get(self, key: T) -> T:
         """Get value for key or raise KeyError if key not found"""
-        cursor = self.connection().cursor()
-        cursor.execute("SELECT value FROM data WHERE key = ?;", (key,))
-        if result := cursor.fetchone():
+        with self._reader() as conn:
+            result = conn.execute(_SQL_GET, (key,)).fetchone()
+        if result:
             return self._deserialize(result[0])
         raise KeyError(key)
 
-    def _serialize(self, value: T) -> T:
-        """Serialize value using serialize function if provided"""
-        return self._serialize_func(value) if self._serialize_func else value
-
-    def _deserialize(self, value: T) -> T:
-        """Deserialize value using deserialize function if provided"""
-        return self._deserialize_func(value) if self._deserialize_func else value
+    def _delete(self, key: T) -> bool:
+        """Delete key, returning True if key was found and deleted"""
+        with self._lock:
+            deleted = self._conn.execute(_SQL_DEL, (key,)).rowcount
+            self._adjust_len(-deleted, deleted)
+            return deleted > 0
+
+    def _adjust_len(self, delta: int, changes: int):
+        """Update cached length after a write that changed changes rows; call with lock held"""
+        if self._len is None:
+            return
+        if self._conn.total_changes - changes != self._len_changes:
+            # connection was modified by something other than this store
+            self._len = None
+            return
+        self._len += delta
+        self._len_changes = self._conn.total_changes
 
     def __getitem__(self, key: T) -> T:
         return self._get(key)
@@ -216,23 +549,18 @@ class SQLiteKVStore:
         self.set(key, value)
 
     def __delitem__(self, key: T):
-        # try to get the key which will raise KeyError if key does not exist
-        if key in self:
-            self.delete(key)
-        else:
+        # delete and check whether a row was removed rather than testing for the key first
+        if not self._delete(key):
             raise KeyError(key)
 
     def __iter__(self):
-        cursor = self.connection().cursor()
-        cursor.execute("SELECT key FROM data;")
-        for key in cursor:
-            yield key[0]
+        for rows in self._fetch(_SQL_KEYS):
+            yield from (row[0] for row in rows)
 
     def __contains__(self, key: T) -> bool:
         # Implement in operator, don't use _get to avoid deserializing value unnecessarily
-        cursor = self.connection().cursor()
-        cursor.execute("SELECT 1 FROM data WHERE key = ?;", (key,))
-        return bool(cursor.fetchone())
+        with self._reader() as conn:
+            return bool(conn.execute(_SQL_CONTAINS, (key,)).fetchone()[0])
 
     def __enter__(self):
         return self
@@ -241,11 +569,195 @@ class SQLiteKVStore:
         self.close()
 
     def __len__(self):
-        cursor = self.connection().cursor()
-        cursor.execute("SELECT COUNT(*) FROM data;")
-        return cursor.fetchone()[0]
+        # The cached length is valid as long as nothing else wrote to the database:
+        # total_changes catches writes made directly on our connection and
+        # data_version catches commits from any other connection or process
+        with self._lock:
+            conn = self._conn
+            data_version = conn.execute(_SQL_DATA_VERSION).fetchone()[0]
+            if (
+                self._len is None
+                or self._len_changes != conn.total_changes
+                or self._len_data_version != data_version
+            ):
+                self._len = conn.execute(_SQL_LEN).fetchone()[0]
+                self._len_changes = conn.total_changes
+                self._len_data_version = data_version
+            return self._len
 
     def __del__(self):
         """Try to close the database in case it wasn't already closed. Don't count on this!"""
         with contextlib.suppress(Exception):
             self.close()
+
+
+class ShardedKVStore:
+    """Key-Value Store that spreads keys across several SQLiteKVStore databases
+
+    Each key is stored in exactly one shard, picked by hashing the key, and each
+    shard is a separate database file with its own write lock so writes to
+    different shards don't wait on each other.
+    """
+
+    def __init__(
+        self,
+        paths: Sequence[str],
+        hash_func: Optional[Callable[[Any], int]] = None,
+        **kwargs,
+    ):
+        """Opens each shard database if it exists, otherwise creates it
+
+        Args:
+            paths: paths to the shard databases; must be distinct and must be given
+                in the same order every time the store is opened
+            hash_func: optional function that returns an int for a key which is used
+                to pick the key's shard; must return the same value for a key in every
+                process so the builtin hash() is not suitable; default uses CRC-32
+            **kwargs: passed to SQLiteKVStore for each shard, e.g. serialize, deserialize, wal
+        """
+        if not paths:
+            raise ValueError("at least one path is required")
+        if len({str(path) for path in paths}) != len(paths):
+            raise ValueError("paths must be distinct")
+        if hash_func and not callable(hash_func):
+            raise TypeError("hash_func must be callable")
+
+        self._paths = list(paths)
+        self._hash = hash_func or _stable_hash
+        self._shards = [SQLiteKVStore(path, **kwargs) for path in paths]
+
+    def _shard(self, key: T) -> SQLiteKVStore:
+        """Return the shard that stores key"""
+        return self._shards[self._hash(key) % len(self._shards)]
+
+    def _group(self, keys: Iterable[T]) -> Dict[int, List[T]]:
+        """Group keys by index of the shard that stores them"""
+        groups: Dict[int, List[T]] = {}
+        for key in keys:
+            groups.setdefault(self._hash(key) % len(self._shards), []).append(key)
+        return groups
+
+    def set(self, key: T, value: T):
+        """Set key:value pair"""
+        self._shard(key).set(key, value)
+
+    def set_many(self, items: Union[Iterable[Tuple[T, T]], Dict[T, T]]):
+        """Set multiple key:value pairs
+
+        Args:
+            items: iterable of (key, value) tuples or dictionary of key:value pairs
+
+        Note: pairs are written in a single transaction per shard
+        """
+        _items = items.items() if isinstance(items, dict) else items
+        groups: Dict[int, List[Tuple[T, T]]] = {}
+        for key, value in _items:
+            groups.setdefault(self._hash(key) % len(self._shards), []).append(
+                (key, value)
+            )
+        for index, shard_items in groups.items():
+            self._shards[index].set_many(shard_items)
+
+    def get(self, key: T, default: Optional[T] = None) -> Optional[T]:
+        """Get value for key
+
+        Args:
+            key: key to get from key-value store
+            default: optional default value to return if key not found
+
+        Returns: value for key or default
+        """
+        return self._shard(key).get(key, default)
+
+    def get_many(self, keys: Iterable[T]) -> Dict[T, T]:
+        """Get values for multiple keys
+
+        Args:
+            keys: iterable of keys to get from key-value store
+
+        Returns: dictionary of key:value pairs for keys found in the key-value store;
+            keys that are not found are omitted
+        """
+        results = {}
+        for index, shard_keys in self._group(keys).items():
+            results.update(self._shards[index].get_many(shard_keys))
+        return results
+
+    def delete(self, key: T):
+        """Delete key from key-value store"""
+        self._shard(key).delete(key)
+
+    def delete_many(self, keys: Iterable[T]):
+        """Delete multiple keys from key-value store
+
+        Note: keys are deleted in a single transaction per shard
+        """
+        for index, shard_keys in self._group(keys).items():
+            self._shards[index].delete_many(shard_keys)
+
+    def pop(self, key) -> Optional[T]:
+        """Delete key and return value"""
+        return self._shard(key).pop(key)
+
+    def keys(self) -> Generator[T, None, None]:
+        """Return keys as generator"""
+        return iter(self)
+
+    def values(self) -> Generator[T, None, None]:
+        """Return values as generator"""
+        for shard in self._shards:
+            yield from shard.values()
+
+    def items(self) -> Generator[Tuple[T, T], None, None]:
+        """Return items (key, value) as generator"""
+        for shard in self._shards:
+            yield from shard.items()
+
+    def close(self):
+        """Close all shard databases"""
+        for shard in self._shards:
+            shard.close()
+
+    @property
+    def paths(self) -> List[str]:
+        """Return paths to the shard databases"""
+        return list(self._paths)
+
+    def shards(self) -> List[SQLiteKVStore]:
+        """Return the underlying SQLiteKVStore for each shard"""
+        return list(self._shards)
+
+    def wipe(self):
+        """Wipe all shard databases"""
+        for shard in self._shards:
+            shard.wipe()
+
+    def vacuum(self):
+        """Vacuum all shard databases"""
+        for shard in self._shards:
+            shard.vacuum()
+
+    def __getitem__(self, key: T) -> T:
+        return self._shard(key)[key]
+
+    def __setitem__(self, key: T, value: T):
+        self.set(key, value)
+
+    def __delitem__(self, key: T):
+        del self._shard(key)[key]
+
+    def __iter__(self):
+        for shard in self._shards:
+            yield from shard
+
+    def __contains__(self, key: T) -> bool:
+        return key in self._shard(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
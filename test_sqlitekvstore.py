@@ -1,9 +1,13 @@
 """Test sqlitekvstore"""
 
+import gc
 import gzip
 import json
 import pickle
 import sqlite3
+import sys
+import threading
+import weakref
 from typing import Any
 
 import pytest
@@ -80,6 +84,71 @@ def test_basic_get_set_wal(tmpdir):
         conn.execute("PRAGMA user_version;")
 
 
+def test_pragmas(tmpdir):
+    """Test connection tuning pragmas are applied to file databases"""
+    dbpath = tmpdir / "kvtest.db"
+    with sqlitekvstore.SQLiteKVStore(dbpath) as kvstore:
+        conn = kvstore.connection()
+        assert conn.execute("PRAGMA temp_store;").fetchone()[0] == 2
+        assert conn.execute("PRAGMA cache_size;").fetchone()[0] == -64000
+        assert conn.execute("PRAGMA journal_mode;").fetchone()[0] != "wal"
+
+
+def test_without_rowid(tmpdir):
+    """Test data table schema with and without rowid"""
+    dbpath = tmpdir / "kvtest.db"
+    with sqlitekvstore.SQLiteKVStore(dbpath) as kvstore:
+        kvstore.set("foo", "bar")
+        sql = (
+            kvstore.connection()
+            .execute("SELECT sql FROM sqlite_master WHERE name = 'data';")
+            .fetchone()[0]
+        )
+        assert "WITHOUT ROWID" in sql
+
+    dbpath = tmpdir / "kvtest_rowid.db"
+    with sqlitekvstore.SQLiteKVStore(dbpath, without_rowid=False) as kvstore:
+        kvstore.set("foo", "bar")
+        assert kvstore.connection().execute("SELECT rowid FROM data;").fetchone()
+        assert kvstore.get("foo") == "bar"
+
+
+def test_get_blob_python_version(tmpdir, monkeypatch):
+    """Test get_blob() raises NotImplementedError before Python 3.11"""
+    dbpath = tmpdir / "kvtest.db"
+    with sqlitekvstore.SQLiteKVStore(dbpath, without_rowid=False) as kvstore:
+        kvstore.set("foo", b"0123456789")
+        monkeypatch.setattr(sqlitekvstore.sys, "version_info", (3, 10, 0))
+        with pytest.raises(NotImplementedError):
+            kvstore.get_blob("foo")
+
+
+@pytest.mark.skipif(sys.version_info < (3, 11), reason="requires Python 3.11+")
+def test_get_blob(tmpdir):
+    """Test get_blob()"""
+    dbpath = tmpdir / "kvtest.db"
+    with sqlitekvstore.SQLiteKVStore(dbpath, without_rowid=False) as kvstore:
+        kvstore.set("foo", b"0123456789")
+        with kvstore.get_blob("foo") as blob:
+            assert len(blob) == 10
+            assert blob[2:5] == b"234"
+            blob.seek(8)
+            assert blob.read() == b"89"
+        with pytest.raises(KeyError):
+            kvstore.get_blob("bar")
+
+    dbpath = tmpdir / "kvtest_without_rowid.db"
+    with sqlitekvstore.SQLiteKVStore(dbpath) as kvstore:
+        kvstore.set("foo", b"0123456789")
+        with pytest.raises(sqlite3.NotSupportedError):
+            kvstore.get_blob("foo")
+
+        # other errors are not translated
+        kvstore.connection().execute("DROP TABLE data;")
+        with pytest.raises(sqlite3.OperationalError, match="no such table"):
+            kvstore.get_blob("foo")
+
+
 def test_set_many(tmpdir):
     """Test set_many()"""
     dbpath = tmpdir / "kvtest.db"
@@ -114,6 +183,116 @@ def test_set_many_dict(tmpdir):
     kvstore.close()
 
 
+def test_set_many_serialize_error(tmpdir):
+    """Test set_many() does not write partial results if serialization fails"""
+    dbpath = tmpdir / "kvtest.db"
+
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath, serialize=json.dumps)
+    with pytest.raises(TypeError):
+        kvstore.set_many([("foo", "bar"), ("baz", object())])
+    assert "foo" not in kvstore
+    assert len(kvstore) == 0
+    kvstore.close()
+
+
+def test_set_many_rollback(tmpdir):
+    """Test set_many() rolls back if a write fails part way through the transaction"""
+    dbpath = tmpdir / "kvtest.db"
+
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath)
+    # a list can't be bound as a value so the second insert fails
+    with pytest.raises(sqlite3.Error):
+        kvstore.set_many([("a", 1), ("b", [1, 2])])
+    assert "a" not in kvstore
+    assert len(kvstore) == 0
+    assert not kvstore.connection().in_transaction
+    kvstore.set("a", 1)
+    assert kvstore["a"] == 1
+    kvstore.close()
+
+
+def test_set_many_commit_fails(tmpdir):
+    """Test set_many() rolls back if the commit fails"""
+    dbpath = tmpdir / "kvtest.db"
+
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath)
+    kvstore.set("foo", "bar")
+    kvstore.connection().execute("PRAGMA busy_timeout=100;")
+
+    # hold a SHARED lock so the commit can't get the EXCLUSIVE lock it needs
+    reader = sqlite3.connect(dbpath, isolation_level=None)
+    reader.execute("BEGIN;")
+    reader.execute("SELECT * FROM data;").fetchall()
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        kvstore.set_many([("a", 1), ("b", 2)])
+    assert not kvstore.connection().in_transaction
+    reader.execute("COMMIT;")
+    reader.close()
+
+    kvstore.set("c", 3)
+    kvstore.set_many([("d", 4)])
+    kvstore.close()
+
+    with sqlitekvstore.SQLiteKVStore(dbpath) as kvstore:
+        assert sorted(kvstore.keys()) == ["c", "d", "foo"]
+
+
+def test_delete_many_rollback(tmpdir):
+    """Test delete_many() rolls back if a delete fails part way through the transaction"""
+    dbpath = tmpdir / "kvtest.db"
+
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath)
+    kvstore.set_many((f"key{i}", i) for i in range(600))
+    # the first chunk of keys is deleted before the bad key in the second chunk fails
+    keys = [f"key{i}" for i in range(600)] + [[1, 2]]
+    with pytest.raises(sqlite3.Error):
+        kvstore.delete_many(keys)
+    assert len(kvstore) == 600
+    assert kvstore["key0"] == 0
+    assert not kvstore.connection().in_transaction
+    kvstore.close()
+
+
+def test_get_many(tmpdir):
+    """Test get_many()"""
+    dbpath = tmpdir / "kvtest.db"
+
+    kvstore = sqlitekvstore.SQLiteKVStore(
+        dbpath, serialize=json.dumps, deserialize=json.loads
+    )
+    kvstore.set_many((f"key{i}", {"value": i}) for i in range(1200))
+    keys = [f"key{i}" for i in range(0, 1300, 2)]
+    values = kvstore.get_many(keys)
+    assert len(values) == 600
+    assert values["key1198"] == {"value": 1198}
+    assert "key1200" not in values
+    assert kvstore.get_many([]) == {}
+    kvstore.close()
+
+
+def test_delete_many(tmpdir):
+    """Test delete_many()"""
+    dbpath = tmpdir / "kvtest.db"
+
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath)
+    kvstore.set_many((f"key{i}", i) for i in range(1200))
+    kvstore.delete_many(f"key{i}" for i in range(0, 1300, 2))
+    assert len(kvstore) == 600
+    assert "key0" not in kvstore
+    assert kvstore["key1199"] == 1199
+    kvstore.delete_many([])
+    assert len(kvstore) == 600
+
+    # keys are collected before the transaction starts
+    def keys():
+        assert not kvstore.connection().in_transaction
+        yield "key1"
+
+    kvstore.delete_many(keys())
+    assert len(kvstore) == 599
+    kvstore.close()
+
+
 def test_basic_context_handler(tmpdir):
     """Test basic functionality with context handler"""
 
@@ -140,6 +319,9 @@ def test_about(tmpdir):
         kvstore.about = "My new description"
         assert kvstore.about == "My new description"
 
+    with sqlitekvstore.SQLiteKVStore(dbpath) as kvstore:
+        assert kvstore.about == "My new description"
+
 
 def test_existing_db(tmpdir):
     """Test that opening an existing database works as expected"""
@@ -151,6 +333,15 @@ def test_existing_db(tmpdir):
         assert kvstore.get("foo") == "bar"
 
 
+def test_existing_empty_file(tmpdir):
+    """Test that an existing but empty file is initialized as a database"""
+    dbpath = tmpdir / "kvtest.db"
+    dbpath.write("")
+    with sqlitekvstore.SQLiteKVStore(dbpath) as kvstore:
+        kvstore.set("foo", "bar")
+        assert kvstore.get("foo") == "bar"
+
+
 def test_dict_interface(tmpdir):
     """ "Test dict interface"""
     dbpath = tmpdir / "kvtest.db"
@@ -183,6 +374,19 @@ def test_dict_interface(tmpdir):
             kvstore.pop("foo")
 
 
+def test_key_types(tmpdir):
+    """Test keys are stored as given and str/bytes keys are distinct"""
+    dbpath = tmpdir / "kvtest.db"
+    with sqlitekvstore.SQLiteKVStore(dbpath) as kvstore:
+        kvstore["foo"] = "str"
+        kvstore[b"foo"] = "bytes"
+        kvstore[1] = "int"
+        assert kvstore["foo"] == "str"
+        assert kvstore[b"foo"] == "bytes"
+        assert kvstore[1] == "int"
+        assert sorted(kvstore.keys(), key=repr) == sorted(["foo", b"foo", 1], key=repr)
+
+
 def test_serialize_deserialize(tmpdir):
     """Test serialize/deserialize"""
     dbpath = tmpdir / "kvtest.db"
@@ -245,6 +449,54 @@ def test_keys_values_items(tmpdir):
     ]
 
 
+def test_keys_values_items_many(tmpdir):
+    """Test keys, values, items with more rows than are fetched at once"""
+    dbpath = tmpdir / "kvtest.db"
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath, deserialize=str)
+    count = sqlitekvstore._FETCH_SIZE * 2 + 1
+    kvstore.set_many((i, i) for i in range(count))
+    assert sorted(kvstore.keys()) == list(range(count))
+    assert sorted(kvstore.values(), key=int) == [str(i) for i in range(count)]
+    assert sorted(kvstore.items()) == [(i, str(i)) for i in range(count)]
+
+
+def test_len(tmpdir):
+    """Test len() stays correct as the database changes"""
+    dbpath = tmpdir / "kvtest.db"
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath)
+    assert len(kvstore) == 0
+    kvstore.set("foo", "bar")
+    kvstore.set("foo", "baz")
+    assert len(kvstore) == 1
+    kvstore.set_many({"foo": 1, "bar": 2, "baz": 3})
+    assert len(kvstore) == 3
+    kvstore.delete("foo")
+    kvstore.delete("foo")
+    assert len(kvstore) == 2
+    del kvstore["bar"]
+    assert len(kvstore) == 1
+    kvstore.delete_many(["baz", "qux"])
+    assert len(kvstore) == 0
+
+    # writes made directly on the connection
+    kvstore.connection().execute("INSERT INTO data VALUES ('foo', 'bar');")
+    assert len(kvstore) == 1
+    kvstore.connection().execute("INSERT INTO data VALUES ('bar', 'baz');")
+    kvstore.set("baz", "qux")
+    assert len(kvstore) == 3
+
+    # writes made by another connection
+    conn = sqlite3.connect(dbpath)
+    conn.execute("DELETE FROM data WHERE key = 'foo';")
+    conn.commit()
+    conn.close()
+    assert len(kvstore) == 2
+
+    kvstore.wipe()
+    assert len(kvstore) == 0
+    kvstore.close()
+
+
 def test_path(tmpdir):
     """Test path property"""
     dbpath = tmpdir / "kvtest.db"
@@ -266,3 +518,270 @@ def test_wipe(tmpdir):
     assert "foo"
     kvstore.set("foo", "bar")
     assert kvstore.get("foo") == "bar"
+
+
+def test_thread_safety_concurrent_writes(tmpdir):
+    """Test writing to a shared store from multiple threads"""
+    dbpath = tmpdir / "kvtest.db"
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath, wal=True)
+
+    def writer(thread_id: int):
+        for i in range(100):
+            kvstore.set(f"{thread_id}:{i}", i)
+
+    threads = [threading.Thread(target=writer, args=(t,)) for t in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(kvstore) == 1000
+    for t in range(10):
+        for i in range(100):
+            assert kvstore[f"{t}:{i}"] == i
+    kvstore.close()
+
+
+@pytest.mark.parametrize("wal", [False, True])
+def test_thread_safety_uncommitted_reads(tmpdir, wal):
+    """Test other threads don't see a transaction's changes before it commits"""
+    dbpath = tmpdir / "kvtest.db"
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath, wal=wal)
+    kvstore.set_many({"key0": 0, "key1": 1})
+    results = []
+
+    def reader():
+        results.append("key0" in kvstore)
+        results.append(kvstore.get("key0"))
+        results.append(kvstore.get_many(["key0"]))
+        results.append(sorted(kvstore.keys()))
+
+    thread = threading.Thread(target=reader)
+    with pytest.raises(RuntimeError):
+        with kvstore._transaction() as conn:
+            conn.execute("DELETE FROM data WHERE key = 'key0';")
+            thread.start()
+            thread.join(0.2)
+            raise RuntimeError("roll back")
+    thread.join()
+
+    assert results == [True, 0, {"key0": 0}, ["key0", "key1"]]
+    kvstore.close()
+
+
+def test_iteration_during_writes_from_thread(tmpdir):
+    """Test another thread can write while iteration is suspended between batches"""
+    dbpath = tmpdir / "kvtest.db"
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath)
+    kvstore.set_many((i, i) for i in range(sqlitekvstore._FETCH_SIZE + 1))
+    iterator = iter(kvstore)
+    next(iterator)
+
+    thread = threading.Thread(target=kvstore.set_many, args=([("foo", "bar")],))
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+
+    assert len(list(iterator)) >= sqlitekvstore._FETCH_SIZE
+    assert kvstore["foo"] == "bar"
+    kvstore.close()
+
+
+def test_thread_safety_concurrent_reads_and_writes(tmpdir):
+    """Test reading from multiple threads while another thread writes"""
+    dbpath = tmpdir / "kvtest.db"
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath, wal=True)
+    kvstore.set_many((f"key{i}", i) for i in range(100))
+    errors = []
+
+    def reader():
+        try:
+            for i in range(100):
+                assert kvstore[f"key{i}"] == i
+                assert f"key{i}" in kvstore
+                _ = len(kvstore)
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    def writer():
+        for i in range(100, 200):
+            kvstore.set(f"key{i}", i)
+
+    threads = [threading.Thread(target=reader) for _ in range(5)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert len(kvstore) == 200
+    assert sorted(kvstore.values()) == list(range(200))
+    kvstore.close()
+
+    # pooled read connections are closed too
+    with pytest.raises(sqlite3.ProgrammingError):
+        kvstore.get("key1")
+
+
+def test_iteration_during_writes(tmpdir):
+    """Test writing while iterating over keys in WAL mode"""
+    dbpath = tmpdir / "kvtest.db"
+    with sqlitekvstore.SQLiteKVStore(dbpath, wal=True) as kvstore:
+        kvstore.set_many({"foo": 1, "bar": 2})
+        for key in kvstore:
+            kvstore[key.upper()] = kvstore[key]
+        assert len(kvstore) == 4
+        assert kvstore["FOO"] == 1
+
+
+def test_sharded(tmpdir):
+    """Test ShardedKVStore"""
+    paths = [tmpdir / f"shard{i}.db" for i in range(4)]
+    with sqlitekvstore.ShardedKVStore(
+        paths, serialize=json.dumps, deserialize=json.loads
+    ) as kvstore:
+        kvstore.set("foo", {"bar": "baz"})
+        assert kvstore.get("foo") == {"bar": "baz"}
+        assert kvstore.get("FOOBAR") is None
+        kvstore["fizz"] = "buzz"
+        assert kvstore["fizz"] == "buzz"
+        assert "fizz" in kvstore
+        assert kvstore.pop("fizz") == "buzz"
+        assert "fizz" not in kvstore
+        kvstore.delete("foo")
+        assert len(kvstore) == 0
+        with pytest.raises(KeyError):
+            kvstore["foo"]
+        with pytest.raises(KeyError):
+            del kvstore["foo"]
+
+        kvstore.set_many((f"key{i}", i) for i in range(100))
+        kvstore.set_many({"foo": "bar"})
+        assert len(kvstore) == 101
+        # every shard gets some of the keys
+        assert all(len(shard) for shard in kvstore.shards())
+        assert sorted(kvstore.keys()) == sorted(
+            ["foo"] + [f"key{i}" for i in range(100)]
+        )
+        assert sorted(kvstore.values(), key=str) == sorted(
+            ["bar"] + list(range(100)), key=str
+        )
+        assert dict(kvstore.items())["key42"] == 42
+        assert kvstore.get_many(["key1", "key2", "nokey"]) == {"key1": 1, "key2": 2}
+        del kvstore["key1"]
+        kvstore.delete_many(f"key{i}" for i in range(50))
+        assert len(kvstore) == 51
+        kvstore.vacuum()
+
+    # keys are found in the same shards when reopened
+    with sqlitekvstore.ShardedKVStore(paths) as kvstore:
+        assert kvstore.paths == paths
+        assert len(kvstore) == 51
+        assert kvstore["key99"] == "99"
+        kvstore.wipe()
+        assert len(kvstore) == 0
+
+
+def test_sharded_hash_func(tmpdir):
+    """Test ShardedKVStore with custom hash_func and bad arguments"""
+    paths = [tmpdir / "shard0.db", tmpdir / "shard1.db"]
+    with sqlitekvstore.ShardedKVStore(paths, hash_func=lambda key: 1) as kvstore:
+        kvstore.set_many({"foo": "bar", "baz": "qux"})
+        assert len(kvstore.shards()[0]) == 0
+        assert len(kvstore.shards()[1]) == 2
+
+    with pytest.raises(ValueError):
+        sqlitekvstore.ShardedKVStore([])
+    with pytest.raises(ValueError):
+        sqlitekvstore.ShardedKVStore([paths[0], paths[0]])
+    with pytest.raises(TypeError):
+        sqlitekvstore.ShardedKVStore(paths, hash_func=1)
+
+    # numeric keys that SQLite considers equal go to the same shard
+    assert sqlitekvstore._stable_hash(1) == sqlitekvstore._stable_hash(1.0)
+    assert sqlitekvstore._stable_hash(1) == sqlitekvstore._stable_hash(True)
+    assert sqlitekvstore._stable_hash("foo") == sqlitekvstore._stable_hash(b"foo")
+
+    # bytes-like keys that SQLite binds as the same BLOB go to the same shard
+    assert sqlitekvstore._stable_hash(b"foo") == sqlitekvstore._stable_hash(
+        bytearray(b"foo")
+    )
+    assert sqlitekvstore._stable_hash(b"foo") == sqlitekvstore._stable_hash(
+        memoryview(b"foo")
+    )
+    paths = [tmpdir / f"shard{i}_bytes.db" for i in range(4)]
+    with sqlitekvstore.ShardedKVStore(paths) as kvstore:
+        for i in range(20):
+            kvstore[f"foo{i}".encode()] = i
+        for i in range(20):
+            assert kvstore.get(bytearray(f"foo{i}".encode())) == i
+            assert bytearray(f"foo{i}".encode()) in kvstore
+
+
+@pytest.mark.parametrize("wal", [False, True])
+def test_no_reference_cycle(tmpdir, wal):
+    """Test that a store is freed (and closed) as soon as the last reference is dropped"""
+    dbpath = tmpdir / "kvtest.db"
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath, wal=wal)
+    kvstore.set("foo", "bar")
+    assert kvstore["foo"] == "bar"
+    ref = weakref.ref(kvstore)
+    gc.disable()
+    try:
+        del kvstore
+        assert ref() is None
+    finally:
+        gc.enable()
+
+
+def test_read_pool(tmpdir, monkeypatch):
+    """Test read-only connections are returned to the pool or closed"""
+    dbpath = tmpdir / "kvtest.db"
+    kvstore = sqlitekvstore.SQLiteKVStore(dbpath, wal=True)
+    kvstore.set_many({"foo": 1, "bar": 2})
+
+    readers = []
+    connect_reader = kvstore._connect_reader
+
+    def _connect_reader():
+        conn = connect_reader()
+        readers.append(conn)
+        return conn
+
+    monkeypatch.setattr(kvstore, "_connect_reader", _connect_reader)
+
+    # more concurrent readers than the pool holds; the extra ones are closed
+    iterators = [iter(kvstore) for _ in range(sqlitekvstore._READ_POOL_SIZE + 2)]
+    for iterator in iterators:
+        next(iterator)
+    for iterator in iterators:
+        list(iterator)
+    assert len(readers) == sqlitekvstore._READ_POOL_SIZE + 2
+    assert kvstore._read_pool.qsize() == sqlitekvstore._READ_POOL_SIZE
+    with pytest.raises(sqlite3.ProgrammingError):
+        readers[-1].execute("SELECT 1;")
+
+    # reader still checked out when the store is closed is closed when it's released
+    iterator = iter(kvstore)
+    next(iterator)
+    kvstore.close()
+    assert list(iterator) == ["foo"]
+    for reader in readers:
+        with pytest.raises(sqlite3.ProgrammingError):
+            reader.execute("SELECT 1;")
+
+
+def test_read_pool_relative_path(tmpdir, monkeypatch):
+    """Test pooled readers open the right database after the working directory changes"""
+    (tmpdir / "a").mkdir()
+    (tmpdir / "b").mkdir()
+    monkeypatch.chdir(tmpdir / "b")
+    with sqlitekvstore.SQLiteKVStore("rel.db", wal=True) as other:
+        other.set("foo", "wrong")
+
+    monkeypatch.chdir(tmpdir / "a")
+    with sqlitekvstore.SQLiteKVStore("rel.db", wal=True) as kvstore:
+        kvstore.set("foo", "right")
+        monkeypatch.chdir(tmpdir / "b")
+        assert kvstore.get("foo") == "right"